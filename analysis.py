@@ -0,0 +1,169 @@
+"""
+Clip coverage analysis over a local StatsBomb open-data dump
+
+Runs clip matching (no audio) over every match and reports how often each clip
+matches, which event types get any commentary at all, and which clips are dead.
+"""
+import collections
+import concurrent.futures
+import functools
+import os
+import random
+import typing
+
+import typer
+
+import commentary
+import events
+import filterstats
+
+
+class Coverage(typing.NamedTuple):
+    """ Matching tallies for a set of matches. Clips are keyed by their position in `commentary.CLIPS`. """
+    matches: int
+    events: collections.Counter           # event type -> events seen
+    covered: collections.Counter          # event type -> events with at least one playable matching clip
+    hits: collections.Counter             # clip -> events matched
+    expected_plays: collections.Counter   # clip -> expected times chosen (by weight among the candidates)
+    sole: collections.Counter             # clip -> events where it was the only playable candidate
+    errors: collections.Counter           # clip -> events where its filters raised
+    filters: collections.Counter          # (clip, filter, stat) -> total, when profiling (see filterstats)
+
+    @classmethod
+    def empty(cls) -> 'Coverage':
+        return cls(0, *(collections.Counter() for _ in range(7)))
+
+    def __add__(self, other: 'Coverage') -> 'Coverage':
+        return Coverage(self.matches + other.matches,
+                        *(x + y for x, y in zip(self[1:], other[1:])))
+
+
+def match_event(event, positions: typing.Dict[int, int], coverage: Coverage, profile: bool=False):
+    candidates = []
+    clips = commentary.CLIP_INDEX.get(event.type.name, commentary.CLIP_INDEX[None])
+    for clip in clips:
+        position = positions[id(clip)]
+        try:
+            if clip.match(event):
+                candidates.append(position)
+        except Exception:
+            coverage.errors[position] += 1
+
+    if profile:
+        # Profiling runs every filter, so `with_weight` filters draw more random
+        # numbers; restore the state so coverage matches an unprofiled run
+        state = random.getstate()
+        for clip in clips:
+            filterstats.match(clip, positions[id(clip)], event, coverage.filters)
+        random.setstate(state)
+
+    coverage.events[event.type.name] += 1
+    for i in candidates:
+        coverage.hits[i] += 1
+
+    # Clips with a weight of 0 match, but are never played
+    playable = [i for i in candidates if commentary.CLIPS[i].weight > 0]
+    if not playable:
+        return
+    coverage.covered[event.type.name] += 1
+    total_weight = sum(commentary.CLIPS[i].weight for i in playable)
+    for i in playable:
+        coverage.expected_plays[i] += commentary.CLIPS[i].weight/total_weight
+    if len(playable) == 1:
+        coverage.sole[playable[0]] += 1
+
+
+def analyse_events(match_events: typing.Iterable, match_id: int, seed: typing.Optional[int]=None,
+                   profile: bool=False) -> Coverage:
+    if seed is not None:
+        # `with_weight` filters are random; seed per match so results don't depend on scheduling
+        random.seed(seed + match_id)
+    positions = {id(c): i for i, c in enumerate(commentary.CLIPS)}
+    coverage = Coverage.empty()._replace(matches=1)
+    for event in match_events:
+        match_event(event, positions, coverage, profile)
+    return coverage
+
+
+def analyse_match(path: str, seed: typing.Optional[int]=None, profile: bool=False) -> Coverage:
+    return analyse_events(events.load_events(path), events.match_id(path), seed, profile)
+
+
+def analyse_store_match(path: str, match_id: int, offset: int, length: int,
+                        seed: typing.Optional[int]=None, profile: bool=False) -> Coverage:
+    import store
+    # Each worker opens the store once, and slices it for every match it's given
+    return analyse_events(store.rows(store.load_cached(path).slice(offset, length)), match_id, seed, profile)
+
+
+def _run(job: typing.Callable[[], Coverage]) -> Coverage:
+    return job()
+
+
+def analyse(jobs: typing.List[typing.Callable[[], Coverage]], workers: typing.Optional[int]=None) -> Coverage:
+    """ Run per-match analyses (e.g. partials of `analyse_match`) on a process pool and combine them. """
+    chunksize = max(1, len(jobs) // (4*(workers or os.cpu_count() or 1)))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(_run, jobs, chunksize=chunksize)
+        total = Coverage.empty()
+        for i, result in enumerate(results, 1):
+            total += result
+            if i % 100 == 0:
+                typer.echo(f'Analysed {i}/{len(jobs)} matches...', err=True)
+    return total
+
+
+def report(coverage: Coverage):
+    total_events = sum(coverage.events.values())
+    typer.echo(f'\nAnalysed {total_events} events from {coverage.matches} matches\n')
+
+    typer.echo('Event type coverage')
+    typer.echo(f'  {"event type":<24} {"events":>9} {"covered":>9} {"%":>6}')
+    for event_type, n in coverage.events.most_common():
+        typer.echo(f'  {event_type:<24} {n:>9} {coverage.covered[event_type]:>9} {100*coverage.covered[event_type]/n:>6.1f}')
+
+    typer.echo('\nClip hit rates (% of events of the clip\'s type, or of all events for untyped clips)')
+    typer.echo(f'  {"clip":>5} {"event type":<18} {"hits":>8} {"%":>7} {"plays":>9} {"sole":>8} {"errors":>7}')
+    for i, clip in enumerate(commentary.CLIPS):
+        event_type = commentary.clip_event_type(clip)
+        n = coverage.events[event_type] if event_type else total_events
+        rate = 100*coverage.hits[i]/n if n else 0.0
+        typer.echo(f'  {clip.clip_id:>5} {event_type or "-":<18} {coverage.hits[i]:>8} {rate:>7.2f} '
+                   f'{coverage.expected_plays[i]:>9.1f} {coverage.sole[i]:>8} {coverage.errors[i]:>7}')
+
+    dead = [c.clip_id for i, c in enumerate(commentary.CLIPS) if coverage.hits[i] == 0]
+    always = [c.clip_id for i, c in enumerate(commentary.CLIPS) if coverage.hits[i] and coverage.sole[i] == coverage.hits[i]]
+    uncovered = [t for t in coverage.events if coverage.covered[t] == 0]
+    typer.echo(f'\nDead clips (never matched): {", ".join(map(str, dead)) or "none"}')
+    typer.echo(f'Always chosen (only ever the sole candidate): {", ".join(map(str, always)) or "none"}')
+    typer.echo(f'Event types without commentary: {", ".join(sorted(uncovered)) or "none"}')
+
+
+def main(data_path: str, workers: typing.Optional[int]=None, seed: typing.Optional[int]=None,
+         profile_filters: typing.Optional[str]=None):
+    """
+    DATA_PATH is a StatsBomb open-data checkout (or events file), or an event store (see store.py).
+    --profile-filters writes per-filter selectivity and cost stats to a JSON report (see filterstats.py).
+    """
+    profile = profile_filters is not None
+    if data_path.endswith(('.arrow', '.parquet')):
+        import store
+        jobs = [functools.partial(analyse_store_match, data_path, m, offset, length, seed, profile)
+                for m, (offset, length) in store.match_slices(store.load(data_path)).items()]
+    else:
+        jobs = [functools.partial(analyse_match, p, seed, profile) for p in events.event_files(data_path)]
+    if not jobs:
+        typer.echo(f'No matches found in {data_path}', err=True)
+        raise typer.Exit(1)
+
+    typer.echo(f'Matching clips for {len(jobs)} matches...', err=True)
+    coverage = analyse(jobs, workers)
+    report(coverage)
+
+    if profile:
+        typer.echo(f'\nWriting filter stats to {profile_filters}...')
+        filterstats.save(coverage.filters, profile_filters)
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -19,6 +19,7 @@ Filter = typing.Callable[[statsbombapi.Event], bool]
 class CommentaryClip(typing.NamedTuple):
     clip_id: int
     filters: typing.List[Filter]
+    weight: float = 1.0  # Relative chance of being picked among the matching clips (see selection.py)
 
     def match(self, event: statsbombapi.Event) -> bool:
         try:
@@ -48,8 +49,15 @@ class Composable:
 isnt = Composable(lambda x: not x)
 
 
+class EventTypeIs(Composable):
+    "Event type filter; kept as a distinct type so clips can be indexed by event type"
+    def __init__(self, event_type: str):
+        super().__init__(lambda x: x.type.name == event_type)
+        self.event_type = event_type
+
+
 def event_type_is(event_type: str) -> Filter:
-    return Composable(lambda x: x.type.name == event_type)
+    return EventTypeIs(event_type)
 
 
 @Composable
@@ -765,3 +773,38 @@ CLIPS = (
 
     # I think from this point the clips aren't properly spliced
 )
+
+
+# Matching
+
+ClipIndex = typing.Dict[typing.Optional[str], typing.List[CommentaryClip]]
+
+
+def clip_event_type(clip: CommentaryClip) -> typing.Optional[str]:
+    """ The event type a clip is restricted to, if any. """
+    for f in clip.filters:
+        if isinstance(f, EventTypeIs):
+            return f.event_type
+    return None
+
+
+def index_clips(clips: typing.Sequence[CommentaryClip]) -> ClipIndex:
+    """
+    Group clips by the event type they can match, so that matching an event only
+    has to consider the relevant clips. Clips without an event type filter can
+    match anything, and are included in every group (and under the `None` key).
+    Clips keep their order from `clips` within each group.
+    """
+    event_types = {clip_event_type(c) for c in clips} - {None}
+    index = {t: [c for c in clips if clip_event_type(c) in (t, None)] for t in event_types}
+    index[None] = [c for c in clips if clip_event_type(c) is None]
+    return index
+
+
+CLIP_INDEX = index_clips(CLIPS)
+
+
+def matching_clips(event: statsbombapi.Event, index: ClipIndex=CLIP_INDEX) -> typing.List[CommentaryClip]:
+    """ The clips that can be played for an event. Clips with a weight of 0 are switched off. """
+    candidates = index.get(event.type.name, index[None])
+    return [c for c in candidates if c.weight > 0 and c.match(event)]
@@ -0,0 +1,137 @@
+"""
+Streaming StatsBomb event loading
+
+Events are parsed one at a time from the raw open-data JSON, events outside the
+requested window are dropped as soon as they are read, and the rest are wrapped
+in lightweight views rather than built into full `statsbombapi.Event` objects.
+"""
+import io
+import json
+import os
+import typing
+import urllib.request
+
+
+OPEN_DATA_URL = 'https://raw.githubusercontent.com/statsbomb/open-data/master/data/events/{match_id}.json'
+
+CHUNK_SIZE = 1024*1024
+
+# Attribute names that differ between statsbombapi.Event and the raw JSON
+FIELD_NAMES = {'pass_': 'pass'}
+
+
+class Section:
+    """
+    Attribute access over a raw StatsBomb JSON object, mirroring the attribute
+    paths of `statsbombapi.Event` closely enough for the filters in `commentary`.
+    Missing fields are `None`, as they are on the dataclasses.
+
+    Nested objects are only wrapped when first accessed (and then kept), so the
+    sections a filter never looks at cost nothing beyond the parsed JSON.
+    """
+    __slots__ = ('_data',)
+
+    def __init__(self, data: dict):
+        self._data = data
+
+    def __getattr__(self, name):
+        key = FIELD_NAMES.get(name, name)
+        value = self._data.get(key)
+        if type(value) is dict:
+            value = self._data[key] = Section(value)
+        return value
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self._data!r})'
+
+
+class EventView(Section):
+    """ A single event. Stands in for `statsbombapi.Event`. """
+    __slots__ = ()
+
+
+def start_time(data: dict) -> int:
+    return data['minute']*60 + data['second']
+
+
+def end_time(data: dict) -> int:
+    return start_time(data) + (data.get('duration') or 0)
+
+
+def iter_json_array(stream: typing.TextIO, chunk_size: int=CHUNK_SIZE) -> typing.Iterator[dict]:
+    """ Yield the elements of a top-level JSON array of objects without reading the whole array first. """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    pos = 0
+    started = False
+    eof = False
+    while True:
+        # Skip to the start of the next element
+        while pos < len(buffer) and buffer[pos] in ' \t\r\n,[':
+            started = started or buffer[pos] == '['
+            pos += 1
+        if pos < len(buffer) and buffer[pos] == ']' and started:
+            return
+
+        try:
+            if pos == len(buffer):
+                raise ValueError('Need more data')
+            item, pos = decoder.raw_decode(buffer, pos)
+        except ValueError:
+            # The element is incomplete (or we're between elements): read more
+            if eof:
+                if buffer[pos:].strip():
+                    raise
+                return
+            chunk = stream.read(chunk_size)
+            eof = not chunk
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            continue
+
+        yield item
+
+
+def iter_events(stream: typing.TextIO, start: typing.Optional[int]=None, end: typing.Optional[int]=None) -> typing.Iterator[EventView]:
+    """ Stream the events between `start` and `end` (in seconds) from a StatsBomb events JSON file. """
+    for data in iter_json_array(stream):
+        if start is not None and start_time(data) < start:
+            continue
+        if end is not None and end_time(data) > end:
+            continue
+        yield EventView(data)
+
+
+def load_events(path: str, start: typing.Optional[int]=None, end: typing.Optional[int]=None) -> typing.List[EventView]:
+    """ Load the events from a StatsBomb open-data events file (data/events/<match_id>.json). """
+    with open(path, encoding='utf-8') as f:
+        return list(iter_events(f, start, end))
+
+
+def fetch_raw_events(match_id: int) -> bytes:
+    """ Download the raw events JSON for a match from the StatsBomb open-data repository. """
+    with urllib.request.urlopen(OPEN_DATA_URL.format(match_id=match_id)) as response:
+        return response.read()
+
+
+def parse_events(raw: bytes, start: typing.Optional[int]=None, end: typing.Optional[int]=None) -> typing.List[EventView]:
+    return list(iter_events(io.TextIOWrapper(io.BytesIO(raw), encoding='utf-8'), start, end))
+
+
+def event_files(path: str) -> typing.List[str]:
+    """
+    Find the event files under a path, which may be a single events file, the
+    events directory itself or the root of an open-data checkout.
+    """
+    if os.path.isfile(path):
+        return [path]
+    for events_dir in (os.path.join(path, 'data', 'events'), path):
+        if os.path.isdir(events_dir):
+            files = sorted(f for f in os.listdir(events_dir) if f.endswith('.json'))
+            if files:
+                return [os.path.join(events_dir, f) for f in files]
+    return []
+
+
+def match_id(path: str) -> int:
+    return int(os.path.splitext(os.path.basename(path))[0])
@@ -0,0 +1,143 @@
+"""
+Per-filter selectivity and cost statistics for the clip matcher
+
+While profiling, every filter of a clip is evaluated on every event the clip is
+checked against (not just up to the first failure), timing each one and noting
+whether it passes or raises. Stats are kept in a Counter keyed by
+(clip position in `commentary.CLIPS`, filter index, stat), so runs combine with `+`.
+
+The stats can then be used to reorder each clip's filters so that cheap,
+selective filters run first. A filter that has ever raised is assumed to rely on
+the filters before it (e.g. `x.pass_.length` on the event being a pass), so it
+stays after them; filters that never raised can move anywhere.
+"""
+import collections
+import json
+import time
+import typing
+
+import commentary
+
+
+STATS = ('reached', 'evaluations', 'passes', 'exceptions', 'seconds')
+
+
+def match(clip: commentary.CommentaryClip, position: int, event, stats: collections.Counter) -> bool:
+    """
+    Match an event like `CommentaryClip.match`, recording stats for every filter.
+    `reached` counts the evaluations the normal matcher would have made. A filter
+    raising counts as the clip not matching, rather than raising.
+    """
+    matched = True
+    for i, f in enumerate(clip.filters):
+        started = time.perf_counter()
+        try:
+            passed = bool(f(event))
+        except Exception:
+            passed = None
+        stats[position, i, 'seconds'] += time.perf_counter() - started
+        stats[position, i, 'evaluations'] += 1
+        if matched:
+            stats[position, i, 'reached'] += 1
+        if passed is None:
+            stats[position, i, 'exceptions'] += 1
+        elif passed:
+            stats[position, i, 'passes'] += 1
+        matched = matched and bool(passed)
+    return matched
+
+
+def describe(f: commentary.Filter) -> str:
+    if isinstance(f, commentary.EventTypeIs):
+        return f'event_type_is({f.event_type!r})'
+    f = getattr(f, '_f', f)
+    code = getattr(f, '__code__', None)
+    return f'{f.__qualname__} (line {code.co_firstlineno})' if code else repr(f)
+
+
+def report(stats: collections.Counter, clips: typing.Sequence[commentary.CommentaryClip]=commentary.CLIPS) -> typing.List[dict]:
+    rows = []
+    for position, clip in enumerate(clips):
+        for i, f in enumerate(clip.filters):
+            values = {s: stats[position, i, s] for s in STATS}
+            evaluations = values['evaluations'] or 1
+            rows.append({
+                'clip': position,
+                'clip_id': clip.clip_id,
+                'filter': i,
+                'description': describe(f),
+                **values,
+                'pass_rate': values['passes']/evaluations,
+                'exception_rate': values['exceptions']/evaluations,
+                'mean_microseconds': 1e6*values['seconds']/evaluations,
+            })
+    return rows
+
+
+def save(stats: collections.Counter, path: str):
+    with open(path, 'w') as f:
+        json.dump(report(stats), f, indent=2)
+
+
+# clip position -> (clip id, filter descriptions), as profiled
+Layout = typing.Dict[int, typing.Tuple[int, typing.Tuple[str, ...]]]
+
+
+def clip_layout(clip: commentary.CommentaryClip) -> typing.Tuple[int, typing.Tuple[str, ...]]:
+    return clip.clip_id, tuple(describe(f) for f in clip.filters)
+
+
+def load(path: str) -> typing.Tuple[collections.Counter, Layout]:
+    """ Load a report, along with the clips it was gathered on, to check it against `CLIPS` before use. """
+    with open(path) as f:
+        rows = json.load(f)
+    stats = collections.Counter({(r['clip'], r['filter'], s): r[s] for r in rows for s in STATS})
+    descriptions = collections.defaultdict(dict)
+    for r in rows:
+        descriptions[r['clip'], r['clip_id']][r['filter']] = r['description']
+    layout = {position: (clip_id, tuple(d[i] for i in sorted(d))) for (position, clip_id), d in descriptions.items()}
+    return stats, layout
+
+
+def rank(stats: collections.Counter, position: int, i: int) -> float:
+    """ Expected cost of a filter per event it rules out; lower should go first. """
+    evaluations = stats[position, i, 'evaluations']
+    if not evaluations:
+        return float('inf')
+    cost = stats[position, i, 'seconds']/evaluations
+    rejection_rate = 1 - stats[position, i, 'passes']/evaluations
+    return cost/rejection_rate if rejection_rate > 0 else float('inf')
+
+
+def filter_order(stats: collections.Counter, position: int, n_filters: int) -> typing.List[int]:
+    """ The order to run a clip's filters in: greedily cheapest-per-rejection, keeping raising filters after their guards. """
+    order = []
+    remaining = list(range(n_filters))
+    while remaining:
+        # A raising filter is only available once every filter before it is placed
+        available = [i for i in remaining if not stats[position, i, 'exceptions'] or i == remaining[0]]
+        best = min(available, key=lambda i: (rank(stats, position, i), i))
+        order.append(best)
+        remaining.remove(best)
+    return order
+
+
+def reorder_filters(stats: collections.Counter, layout: typing.Optional[Layout]=None,
+                    clips: typing.Sequence[commentary.CommentaryClip]=commentary.CLIPS) -> typing.Tuple[int, typing.List[int]]:
+    """
+    Reorder the filters of each clip (in place) using stats gathered on those clips
+    in their defined order. Clips that don't match `layout` (e.g. a report from
+    an older `CLIPS`) are left alone, since their stats may belong to other
+    filters. Returns how many clips changed, and the ids of the clips skipped.
+    """
+    changed = 0
+    skipped = []
+    for position, clip in enumerate(clips):
+        if layout is not None and layout.get(position) != clip_layout(clip):
+            skipped.append(clip.clip_id)
+            continue
+        order = filter_order(stats, position, len(clip.filters))
+        if order != list(range(len(clip.filters))):
+            clip.filters[:] = [clip.filters[i] for i in order]
+            changed += 1
+    return changed, skipped
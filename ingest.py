@@ -0,0 +1,173 @@
+"""
+Clip ingest: normalise the commentary clips once, ahead of rendering
+
+Analyses every audio/chunk-*.wav, converts it to one canonical format, normalises
+its loudness and trims leading/trailing silence, writing the results to
+audio/canonical/ along with a manifest of what was measured and done. When the
+manifest exists, `main.load_clip` uses the canonical clips, so renders never
+have to convert between formats.
+
+Clips whose source hasn't changed since the last ingest are skipped.
+"""
+import json
+import os
+import re
+import tempfile
+import typing
+
+import pydub
+import pydub.silence
+import typer
+
+
+AUDIO_DIR = os.path.join(os.path.dirname(__file__), 'audio')
+CANONICAL_DIR = os.path.join(AUDIO_DIR, 'canonical')
+MANIFEST_PATH = os.path.join(CANONICAL_DIR, 'manifest.json')
+
+
+def source_clips() -> typing.Dict[int, str]:
+    clips = {}
+    for filename in os.listdir(AUDIO_DIR):
+        m = re.fullmatch(r'chunk-(\d+)\.wav', filename)
+        if m:
+            clips[int(m.group(1))] = os.path.join(AUDIO_DIR, filename)
+    return clips
+
+
+def load_manifest() -> dict:
+    if not os.path.exists(MANIFEST_PATH):
+        return {}
+    with open(MANIFEST_PATH) as f:
+        return json.load(f)
+
+
+def write_atomically(path: str, write: typing.Callable[[str], None]):
+    """
+    Write a file through `write(temporary path)`, then move it into place, so
+    renders never see a half-written clip or manifest if ingest is interrupted.
+    """
+    fd, temporary = tempfile.mkstemp(prefix=f'.{os.path.basename(path)}.', dir=os.path.dirname(path))
+    os.close(fd)
+    try:
+        write(temporary)
+        os.replace(temporary, path)
+    except BaseException:
+        os.remove(temporary)
+        raise
+
+
+def write_manifest(manifest: dict, path: str):
+    with open(path, 'w') as f:
+        json.dump(manifest, f, indent=2, allow_nan=False)
+
+
+def is_silent(audio: pydub.AudioSegment) -> bool:
+    return audio.dBFS == float('-inf')
+
+
+def describe(audio: pydub.AudioSegment) -> dict:
+    # (Silence has no level; JSON has no -Infinity)
+    silent = is_silent(audio)
+    return {
+        'frame_rate': audio.frame_rate,
+        'channels': audio.channels,
+        'sample_width': audio.sample_width,
+        'duration': audio.duration_seconds,
+        'dbfs': None if silent else audio.dBFS,
+        'max_dbfs': None if silent else audio.max_dBFS,
+    }
+
+
+def trailing_silence(audio: pydub.AudioSegment, silence_threshold: float) -> int:
+    return pydub.silence.detect_leading_silence(audio.reverse(), silence_threshold=silence_threshold)
+
+
+def normalise(audio: pydub.AudioSegment, frame_rate: int, channels: int, sample_width: int,
+              target_dbfs: float, max_peak_dbfs: float, silence_threshold: float) -> typing.Tuple[pydub.AudioSegment, dict]:
+    """ Convert, trim and level a clip. Returns the new audio and a record of what was done. """
+    if is_silent(audio):
+        # Nothing to level or trim against; just convert it
+        audio = audio.set_frame_rate(frame_rate).set_channels(channels).set_sample_width(sample_width)
+        return audio, {'silent': True, 'trimmed_start_ms': 0, 'trimmed_end_ms': 0, 'gain_db': 0.0}
+
+    # Measure silence on the source, relative to its own level
+    threshold = audio.dBFS + silence_threshold
+    leading = pydub.silence.detect_leading_silence(audio, silence_threshold=threshold)
+    trailing = trailing_silence(audio, threshold)
+    if leading + trailing < len(audio):
+        audio = audio[leading:len(audio) - trailing]
+
+    audio = audio.set_frame_rate(frame_rate).set_channels(channels).set_sample_width(sample_width)
+
+    # Level to the target loudness, without pushing peaks past the limit
+    gain = min(target_dbfs - audio.dBFS, max_peak_dbfs - audio.max_dBFS)
+    audio = audio.apply_gain(gain)
+
+    return audio, {'silent': False, 'trimmed_start_ms': leading, 'trimmed_end_ms': trailing, 'gain_db': gain}
+
+
+def ingest(force: bool=False, frame_rate: int=44100, channels: int=1, sample_width: int=2,
+           target_dbfs: float=-20.0, max_peak_dbfs: float=-1.0, silence_threshold: float=-30.0):
+    """
+    Normalise every clip into audio/canonical/. --silence-threshold is relative to
+    each clip's average loudness, in dB.
+    """
+    os.makedirs(CANONICAL_DIR, exist_ok=True)
+    settings = {
+        'frame_rate': frame_rate,
+        'channels': channels,
+        'sample_width': sample_width,
+        'target_dbfs': target_dbfs,
+        'max_peak_dbfs': max_peak_dbfs,
+        'silence_threshold': silence_threshold,
+    }
+
+    manifest = load_manifest()
+    if manifest.get('settings') != settings:
+        # Everything has to be redone for a new canonical format
+        manifest = {}
+    clips = {int(k): v for k, v in manifest.get('clips', {}).items()}
+
+    sources = source_clips()
+    typer.echo(f'Ingesting {len(sources)} clips into {CANONICAL_DIR}...')
+    for clip_id, path in sorted(sources.items()):
+        stat = os.stat(path)
+        source = {'size': stat.st_size, 'mtime': stat.st_mtime}
+        out = os.path.join(CANONICAL_DIR, f'chunk-{clip_id}.wav')
+        if not force and clips.get(clip_id, {}).get('source') == source and os.path.exists(out):
+            continue
+
+        original = pydub.AudioSegment.from_wav(path)
+        audio, processing = normalise(original, frame_rate, channels, sample_width,
+                                      target_dbfs, max_peak_dbfs, silence_threshold)
+        write_atomically(out, lambda path: audio.export(path, format='wav').close())
+        clips[clip_id] = {
+            'source': source,
+            'original': describe(original),
+            'canonical': describe(audio),
+            **processing,
+        }
+        source_format = f'{original.frame_rate}Hz/{original.channels}ch/{8*original.sample_width}bit'
+        if processing['silent']:
+            typer.echo(f'  {clip_id}: {source_format} silent, converted only')
+        else:
+            typer.echo(f'  {clip_id}: {source_format} {original.dBFS:.1f}dBFS -> {audio.dBFS:.1f}dBFS, '
+                       f'trimmed {processing["trimmed_start_ms"]}+{processing["trimmed_end_ms"]}ms')
+
+    # Forget clips whose source has gone (their files go once the manifest no longer lists them)
+    removed = set(clips) - set(sources)
+    for clip_id in removed:
+        del clips[clip_id]
+
+    manifest = {'settings': settings, 'clips': {str(k): v for k, v in sorted(clips.items())}}
+    write_atomically(MANIFEST_PATH, lambda path: write_manifest(manifest, path))
+
+    for clip_id in removed:
+        out = os.path.join(CANONICAL_DIR, f'chunk-{clip_id}.wav')
+        if os.path.exists(out):
+            os.remove(out)
+    typer.echo('All done!')
+
+
+if __name__ == "__main__":
+    typer.run(ingest)
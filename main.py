@@ -1,7 +1,13 @@
+import concurrent.futures
 import functools
+import json
+import math
+import mmap
 import os
-import random
+import tempfile
+import time
 import typing
+import wave
 
 import pydub
 import pydub.playback
@@ -9,12 +15,28 @@ import statsbombapi
 import typer
 
 import commentary
+import events
+import filterstats
+import ingest
+import playback
+import selection
 
 
-class EventCommentary(typing.NamedTuple):
-    """ A StatsBomb event paired with a commentary clip. """
-    event: statsbombapi.Event
-    audio: pydub.AudioSegment
+class Placement(typing.NamedTuple):
+    """ A commentary clip scheduled to play at the time of a StatsBomb event. """
+    event_id: str
+    time: int
+    clip_id: int
+
+
+class AudioFormat(typing.NamedTuple):
+    frame_rate: int
+    channels: int
+    sample_width: int
+
+    @property
+    def frame_width(self) -> int:
+        return self.channels*self.sample_width
 
 
 def start_time(event: statsbombapi.Event) -> int:
@@ -29,43 +51,96 @@ def clip_time(event: statsbombapi.Event) -> int:
     return start_time(event)
 
 
-def pad_audio(audio: pydub.AudioSegment, padding_before: int=0, padding_after: int=0) -> pydub.AudioSegment:
-    return (
-        pydub.AudioSegment.silent(max(0, padding_before)*1000) +
-        audio +
-        pydub.AudioSegment.silent(max(0, padding_after)*1000)
-    )
+@functools.lru_cache(maxsize=16)
+def fetch_raw_events(match_id: int) -> bytes:
+    return events.fetch_raw_events(match_id)
+
+
+def fetch_events(match_id: int, start: int, end: int,
+                 store_path: typing.Optional[str]=None) -> typing.List[events.EventView]:
+    if store_path:
+        # Only needs pyarrow when reading from a store
+        import store
+        return store.fetch_events(store_path, match_id, start, end)
+
+    # Parsed lazily; events outside the window are never built
+    return events.parse_events(fetch_raw_events(match_id), start, end)
 
 
-def fetch_events(match_id: int, start: int, end: int) -> typing.List[statsbombapi.Event]:
-    api = statsbombapi.StatsbombPublic()
-    all_events = api.events(match_id=match_id)
-    return [e for e in all_events if (start <= start_time(e)) and (end_time(e) <= end)]
+@functools.lru_cache(maxsize=None)
+def canonical_clips() -> typing.FrozenSet[int]:
+    """ Clips that have been normalised by ingest.py (none if it hasn't been run). """
+    return frozenset(int(k) for k in ingest.load_manifest().get('clips', {}))
 
 
+def clip_path(clip_id: int) -> str:
+    # Prefer the ingested clip, which is already in the canonical format
+    if clip_id in canonical_clips():
+        return os.path.join(ingest.CANONICAL_DIR, f'chunk-{clip_id}.wav')
+    return os.path.join(ingest.AUDIO_DIR, f'chunk-{clip_id}.wav')
+
+
+@functools.lru_cache(maxsize=None)
+def clip_fingerprint(clip_id: int) -> typing.List:
+    """ Identifies the clip file this process uses (taken with the clip, so it matches the cached audio). """
+    path = clip_path(clip_id)
+    stat = os.stat(path)
+    return [path, stat.st_size, stat.st_mtime_ns]
+
+
+@functools.lru_cache(maxsize=None)
 def load_clip(clip_id: int) -> pydub.AudioSegment:
-    path_to_clip = os.path.join(os.path.dirname(__file__), 'audio', f'chunk-{clip_id}.wav')
-    return pydub.AudioSegment.from_wav(path_to_clip)
+    clip_fingerprint(clip_id)
+    return pydub.AudioSegment.from_wav(clip_path(clip_id))
+
+
+@functools.lru_cache(maxsize=None)
+def clip_info(clip_id: int) -> typing.Tuple[AudioFormat, float]:
+    """ The format and duration (in seconds) of a clip, read from its header without decoding it if possible. """
+    try:
+        with wave.open(clip_path(clip_id)) as w:
+            return AudioFormat(w.getframerate(), w.getnchannels(), w.getsampwidth()), w.getnframes()/w.getframerate()
+    except wave.Error:
+        clip = load_clip(clip_id)
+        return AudioFormat(clip.frame_rate, clip.channels, clip.sample_width), clip.duration_seconds
 
 
-def pick_commentary_clip(event: statsbombapi.Event) -> typing.Optional[pydub.AudioSegment]:
-    matching_clips = [c for c in commentary.CLIPS if c.match(event)]
+def choose_clip(event: statsbombapi.Event, selector: selection.Selector) -> typing.Optional[commentary.CommentaryClip]:
+    matching_clips = commentary.matching_clips(event)
     if len(matching_clips) == 0:
         return None
-    selected_clip = random.choice(matching_clips)
+    selected_clip = selector.choose(matching_clips)
     print(f'Selected {selected_clip.clip_id} for {event.type.name} @ ({event.minute}, {event.second})')
-    return load_clip(selected_clip.clip_id)
+    return selected_clip
 
 
-def join_commentary(x: EventCommentary, y: EventCommentary) -> EventCommentary:
-    # NOTE: It's a monad? Presumably we can simplify the code as a result?
-    event1, audio1 = x
-    event2, audio2 = y
+Choices = typing.Dict[str, typing.Optional[int]]
 
-    audio1 = audio1 or pydub.AudioSegment.silent(duration=0)
-    audio2 = audio2 or pydub.AudioSegment.silent(duration=0)
 
-    # We need to combine 2 audio clips while handling overlapping elegantly
+def choose_clip_id(event: statsbombapi.Event, selector: selection.Selector) -> typing.Optional[int]:
+    selected_clip = choose_clip(event, selector)
+    return selected_clip and selected_clip.clip_id
+
+
+def choose_clips(events: typing.List[statsbombapi.Event], previous: typing.Optional[Choices]=None) -> Choices:
+    """ Choose a clip id (or None) for each event, reusing any choices already made in `previous`. """
+    previous = previous or {}
+    selector = selection.Selector()
+    choices = {}
+    for e in events:
+        if e.id in previous:
+            # Reused choices still count towards avoiding repeats
+            choices[e.id] = previous[e.id]
+            if previous[e.id] is not None:
+                selector.played(previous[e.id])
+        else:
+            choices[e.id] = choose_clip_id(e, selector)
+    return choices
+
+
+def iter_schedule(events: typing.Iterable[statsbombapi.Event],
+                  choose: typing.Callable[[statsbombapi.Event], typing.Optional[int]]) -> typing.Iterator[Placement]:
+    # We need to combine the audio clips while handling overlapping elegantly
     #
     # Imagine we have a timeline of events with variable duration, and some breaks
     # Events: e1--->      e2-->e3----->e4--------->  e5---->e6--->   etc
@@ -85,7 +160,7 @@ def join_commentary(x: EventCommentary, y: EventCommentary) -> EventCommentary:
 
     # So there are 2 scenarios that we need to handle
     # 1: Underlapping - This one is easy, we just fill in the time between audio
-    #                   clips with silence.
+    #                   clips with silence (see `assemble_commentary`).
     # 2: Overlapping  - There is no single correct approach in this case. For now,
     #                   we take the easy approach and simply remove any overlapped
     #                   audio. So in the example above, a3 would get removed and
@@ -93,47 +168,382 @@ def join_commentary(x: EventCommentary, y: EventCommentary) -> EventCommentary:
     #
     # (Of course, there is also the case where the audio clips are perfectly
     #  aligned to the microsecond. We treat this as an overlap.)
-
-    time_to_next_event = clip_time(event2) - (clip_time(event1) + audio1.duration_seconds)
-    if time_to_next_event > 0:
-        # Underlap
-        if y.audio:
-            print(f'Joining clips for {event1.type.name} @ ({event1.minute}, {event1.second})->{audio1.duration_seconds:.2f} and {event2.type.name} @ ({event2.minute}, {event2.second})')
-        return EventCommentary(event1, audio1 + pydub.AudioSegment.silent(duration=time_to_next_event*1000) + audio2)
-
-    # Overlap
-    # NOTE: We don't explicitly fill in the additional silence; this should get
-    # filled in by further invocations of join_commentary, or by the final clipping
-    if y.audio:
-        print(f'Skipping overlapping clip for {event2.type.name} @ ({event2.minute}, {event2.second})')
-        print(f'\t Event starts at ({event2.minute}, {event2.second}) - previous event ends at ({event1.minute}, {event1.second})-> {audio1.duration_seconds:.2f}')
-    return EventCommentary(event1, audio1)
-
-
-def generate_commentary(events: typing.List[statsbombapi.Event]) -> EventCommentary:
-    events_with_commentary = [EventCommentary(e, pick_commentary_clip(e)) for e in events]
-    return functools.reduce(join_commentary, [e for e in events_with_commentary if e.audio])
-
-
-def main(match_id: int, start: int, end: int, audio_out: typing.Optional[str]=None, play: bool=False):
-    # Fetch events from the statbomb API
+    previous_end = None
+    for event in events:
+        clip_id = choose(event)
+        if clip_id is None:
+            continue
+
+        if previous_end is not None and clip_time(event) <= previous_end:
+            print(f'Skipping overlapping clip for {event.type.name} @ ({event.minute}, {event.second})')
+            print(f'\t Event starts at {clip_time(event)}s - previous clip ends at {previous_end:.2f}s')
+            continue
+
+        yield Placement(event.id, clip_time(event), clip_id)
+        previous_end = clip_time(event) + clip_info(clip_id)[1]
+
+
+def schedule_commentary(events: typing.List[statsbombapi.Event], choices: Choices) -> typing.List[Placement]:
+    return list(iter_schedule(events, lambda e: choices.get(e.id)))
+
+
+def clips_format(clip_ids: typing.Iterable[int]) -> AudioFormat:
+    """ The smallest format that every clip fits (as pydub picks when joining clips). """
+    formats = [clip_info(clip_id)[0] for clip_id in clip_ids]
+    if not formats:
+        # Silence (e.g. a window with no commentary) in a format any clip could have had
+        return library_format()
+    return AudioFormat(*(max(values) for values in zip(*formats)))
+
+
+def plan_format(placements: typing.List[Placement]) -> AudioFormat:
+    return clips_format(p.clip_id for p in placements)
+
+
+@functools.lru_cache(maxsize=None)
+def library_format() -> AudioFormat:
+    """ The format that every clip in the library fits, for when the plan isn't known up front. """
+    return clips_format(c.clip_id for c in commentary.CLIPS)
+
+
+def convert_clip(audio: pydub.AudioSegment, audio_format: AudioFormat) -> pydub.AudioSegment:
+    # pydub returns the clip itself for each step that doesn't change anything, so
+    # this costs nothing when every clip has been ingested into the same format
+    return (audio
+            .set_frame_rate(audio_format.frame_rate)
+            .set_channels(audio_format.channels)
+            .set_sample_width(audio_format.sample_width))
+
+
+def clip_writes(placements: typing.Iterable[Placement], start: int,
+                audio_format: AudioFormat) -> typing.Iterator[typing.Tuple[int, bytes]]:
+    """
+    Where each planned clip goes in a raw track from `start` (in match seconds): the
+    byte offset of its event, and its audio converted to the track's format.
+    """
+    frame_bytes = audio_format.frame_rate*audio_format.frame_width
+    for p in placements:
+        yield (p.time - start)*frame_bytes, convert_clip(load_clip(p.clip_id), audio_format).raw_data
+
+
+def mix_writes(writes: typing.List[typing.Tuple[int, bytes]], length: int,
+               track: typing.Optional[bytearray]=None) -> bytearray:
+    """
+    Write clips into a raw track (modified in place if given, otherwise silent),
+    padding it to at least `length` bytes, or to the end of the last clip.
+    """
+    track = track if track is not None else bytearray()
+    length = max([offset + len(data) for offset, data in writes] + [length])
+    if length > len(track):
+        track.extend(bytes(length - len(track)))
+    for offset, data in writes:
+        track[offset:offset + len(data)] = data
+    return track
+
+
+def track_length(placements: typing.List[Placement], start: int, end: int, audio_format: AudioFormat) -> int:
+    """ The length in bytes of the mixed track: up to `end`, or the end of the last clip if that's later. """
+    writes = clip_writes(placements[-1:], start, audio_format)
+    return max([offset + len(data) for offset, data in writes] + [(end - start)*audio_format.frame_rate*audio_format.frame_width])
+
+
+def assemble_commentary(placements: typing.List[Placement], start: int, end: int,
+                        audio_format: typing.Optional[AudioFormat]=None,
+                        base: typing.Optional[bytearray]=None) -> pydub.AudioSegment:
+    """
+    Mix the planned clips into a single track from `start` to `end` (in match
+    seconds). Each clip is written at the exact sample offset of its event, with
+    silence in between. The track runs past `end` if the last clip does.
+
+    `base` is raw audio in the same format and from the same start to mix the clips
+    into (it is modified in place), so that only clips it doesn't already contain
+    need to be passed in.
+    """
+    audio_format = audio_format or plan_format(placements)
+    length = (end - start)*audio_format.frame_rate*audio_format.frame_width
+    track = mix_writes(list(clip_writes(placements, start, audio_format)), length, base)
+    return pydub.AudioSegment(data=bytes(track), **audio_format._asdict())
+
+
+def stream_commentary(placements: typing.Iterable[Placement], start: int, end: int,
+                      audio_format: AudioFormat) -> typing.Iterator[bytes]:
+    """
+    Yield the same track as `assemble_commentary`, in order, as each clip is placed.
+    Clips are converted to `audio_format`, which has to be decided up front.
+    """
+    position = 0
+    for offset, data in clip_writes(placements, start, audio_format):
+        yield bytes(offset - position)
+        yield data
+        position = offset + len(data)
+    yield bytes(max(0, (end - start)*audio_format.frame_rate*audio_format.frame_width - position))
+
+
+def mix_segment(placements: typing.List[Placement], start: int, audio_format: AudioFormat, path: str) -> int:
+    """
+    Write the clips for part of a plan into the (pre-sized) raw track at `path`,
+    at the same offsets as `assemble_commentary`. Returns where the last clip ends.
+    """
+    track_end = 0
+    with open(path, 'r+b') as f, mmap.mmap(f.fileno(), 0) as track:
+        for offset, data in clip_writes(placements, start, audio_format):
+            track[offset:offset + len(data)] = data
+            track_end = offset + len(data)
+    return track_end
+
+
+def mix_parallel(placements: typing.List[Placement], start: int, end: int, workers: int) -> pydub.AudioSegment:
+    """
+    Mix a plan into the same track as `assemble_commentary`, with segments of the
+    plan mixed on a process pool. Scheduled clips never overlap, so every gap
+    between them is a safe cut, and each segment writes its clips straight into a
+    shared memory-mapped track.
+    """
+    audio_format = plan_format(placements)
+    frame_bytes = audio_format.frame_rate*audio_format.frame_width
+    length = (end - start)*frame_bytes
+    if not placements:
+        return pydub.AudioSegment(data=bytes(length), **audio_format._asdict())
+
+    # Room for the last clip, plus slack for resampling changing its length slightly
+    last = placements[-1]
+    size = max(length, (last.time - start + math.ceil(clip_info(last.clip_id)[1]) + 1)*frame_bytes)
+
+    n_segments = min(len(placements), 4*workers)
+    bounds = [len(placements)*i//n_segments for i in range(n_segments + 1)]
+    segments = [placements[a:b] for a, b in zip(bounds, bounds[1:])]
+
+    with tempfile.NamedTemporaryFile() as f:
+        f.truncate(size)
+        f.flush()
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            mix = functools.partial(mix_segment, start=start, audio_format=audio_format, path=f.name)
+            ends = list(pool.map(mix, segments))
+        f.seek(0)
+        data = f.read(max(ends + [length]))
+
+    return pydub.AudioSegment(data=data, **audio_format._asdict())
+
+
+def generate_commentary(events: typing.List[statsbombapi.Event], start: int, end: int, workers: int=1) -> pydub.AudioSegment:
+    placements = schedule_commentary(events, choose_clips(events))
+    if workers > 1:
+        return mix_parallel(placements, start, end, workers)
+    return assemble_commentary(placements, start, end)
+
+
+class RenderCache:
+    """
+    The plan and assembled audio of the last render of each match, kept on disk so
+    that a later, overlapping render only has to match, schedule and mix what changed.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def _plan_path(self, match_id: int) -> str:
+        return os.path.join(self.path, f'{match_id}.json')
+
+    def _load_plan(self, match_id: int) -> typing.Optional[dict]:
+        try:
+            with open(self._plan_path(match_id)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def load(self, match_id: int) -> typing.Optional[typing.Tuple[dict, bytearray]]:
+        plan = self._load_plan(match_id)
+        if not plan or 'audio' not in plan:
+            return None
+        audio = bytearray(plan['audio_length'])
+        try:
+            # (A newer render may have just replaced it)
+            with open(os.path.join(self.path, plan['audio']), 'rb') as f:
+                if f.readinto(audio) != len(audio) or f.read(1):
+                    return None
+        except OSError:
+            return None
+        return plan, audio
+
+    def save(self, match_id: int, start: int, end: int, choices: Choices,
+             placements: typing.List[Placement], audio: pydub.AudioSegment):
+        """
+        Each render's audio gets a file of its own, named in the plan, and the plan
+        is replaced in one step. So a plan is only ever seen with its own audio,
+        even if saving is interrupted or two renders of the match save at once.
+        """
+        previous = self._load_plan(match_id)
+
+        fd, audio_path = tempfile.mkstemp(prefix=f'{match_id}.', suffix='.pcm', dir=self.path)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(audio.raw_data)
+        plan = {
+            'start': start,
+            'end': end,
+            'format': [audio.frame_rate, audio.channels, audio.sample_width],
+            'choices': choices,
+            'placements': [list(p) for p in placements],
+            'clips': {p.clip_id: clip_fingerprint(p.clip_id) for p in placements},
+            'audio': os.path.basename(audio_path),
+            'audio_length': len(audio.raw_data),
+        }
+        fd, plan_path = tempfile.mkstemp(prefix=f'{match_id}.', suffix='.json.tmp', dir=self.path)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(plan, f)
+        os.replace(plan_path, self._plan_path(match_id))
+
+        if previous and previous.get('audio'):
+            try:
+                os.remove(os.path.join(self.path, previous['audio']))
+            except OSError:
+                pass
+
+
+def reusable_audio(previous: dict, previous_audio: bytearray, placements: typing.List[Placement],
+                   start: int, audio_format: AudioFormat) -> typing.Tuple[bytearray, typing.Set[Placement]]:
+    """
+    Find the longest run of placements shared with a previous render, and cut the
+    audio for it out of that render. Nothing else can be playing in the span of a
+    shared run (in either render), so its audio is exactly what we would mix again,
+    as long as its clip files haven't changed since (e.g. by ingest.py).
+
+    Returns raw audio from `start` up to the end of the run (silent before it) and
+    the placements it covers. `previous_audio` may be reused for the result.
+    """
+    if AudioFormat(*previous['format']) != audio_format:
+        return bytearray(), set()
+
+    # Placements of clips that have changed can't be shared (None matches nothing)
+    fingerprints = previous.get('clips', {})
+    previous_placements = [Placement(*p) for p in previous['placements']]
+    previous_placements = [p if fingerprints.get(str(p.clip_id)) == clip_fingerprint(p.clip_id) else None
+                           for p in previous_placements]
+    previous_index = {p: i for i, p in enumerate(previous_placements) if p is not None}
+
+    best = (0, 0, 0)  # length, index in placements, index in previous_placements
+    i = 0
+    while i < len(placements):
+        j = previous_index.get(placements[i])
+        if j is None:
+            i += 1
+            continue
+        n = 1
+        while (i + n < len(placements) and j + n < len(previous_placements)
+               and placements[i + n] == previous_placements[j + n]):
+            n += 1
+        best = max(best, (n, i, j))
+        i += n
+
+    n, i, j = best
+    if n == 0:
+        return bytearray(), set()
+
+    frame_bytes = audio_format.frame_rate*audio_format.frame_width
+    first, last = placements[i], placements[i + n - 1]
+    run_start = (first.time - previous['start'])*frame_bytes
+    [(last_offset, last_data)] = clip_writes([last], previous['start'], audio_format)
+    run_end = last_offset + len(last_data)
+
+    if previous['start'] == start:
+        # Same start (e.g. an extended window): keep the previous audio as it is,
+        # clearing anything after the run
+        del previous_audio[run_end:]
+        previous_audio[:run_start] = bytes(run_start)
+        return previous_audio, set(placements[i:i + n])
+
+    audio = bytearray((first.time - start)*frame_bytes)
+    audio += memoryview(previous_audio)[run_start:run_end]
+    return audio, set(placements[i:i + n])
+
+
+def render_incremental(match_events: typing.List[statsbombapi.Event], match_id: int, start: int, end: int,
+                       cache: RenderCache) -> pydub.AudioSegment:
+    previous, previous_audio = cache.load(match_id) or ({}, bytearray())
+    if previous and not (previous['start'] < end and start < previous['end']):
+        previous, previous_audio = {}, bytearray()
+
+    choices = choose_clips(match_events, previous.get('choices'))
+    placements = schedule_commentary(match_events, choices)
+    audio_format = plan_format(placements)
+
+    base, reused = bytearray(), set()
+    if previous:
+        base, reused = reusable_audio(previous, previous_audio, placements, start, audio_format)
+        typer.echo(f'Reusing {len(reused)} of {len(placements)} clips from the previous render '
+                   f'({previous["start"]}s-{previous["end"]}s)...')
+
+    audio = assemble_commentary([p for p in placements if p not in reused], start, end, audio_format, base)
+    cache.save(match_id, start, end, choices, placements, audio)
+    return audio
+
+
+def render(match_id: int, start: int, end: int, cache_dir: typing.Optional[str]=None,
+           store_path: typing.Optional[str]=None, workers: int=1) -> pydub.AudioSegment:
+    # Fetch events from the statsbomb open data
     typer.echo(f'Fetching events for match {match_id} between {start}s and {end}s...')
-    events = fetch_events(match_id, start, end)
+    match_events = fetch_events(match_id, start, end, store_path)
 
-    # Map event->audio and concatenate together
+    # Map event->audio and mix together, filling any time between clips with silence
     typer.echo(f'Generating commentary...')
-    init_event, audio = generate_commentary(events)
+    if cache_dir:
+        return render_incremental(match_events, match_id, start, end, RenderCache(cache_dir))
+    return generate_commentary(match_events, start, end, workers)
+
 
-    # Fill any time at the start or end of the clip
-    time_to_start = clip_time(init_event) - start
-    time_remaining = (end-start) - (audio.duration_seconds+time_to_start)
-    audio = pad_audio(audio, time_to_start, time_remaining)
+def render_playing(match_id: int, start: int, end: int, sink: playback.Sink,
+                   store_path: typing.Optional[str]=None) -> pydub.AudioSegment:
+    """ Render while playing the commentary, starting playback as soon as the first clip is placed. """
+    started_at = time.monotonic()
+    typer.echo(f'Fetching events for match {match_id} between {start}s and {end}s...')
+    match_events = fetch_events(match_id, start, end, store_path)
+
+    # We don't know every clip ahead of time, so play in a format that any clip fits
+    placements = iter_schedule(match_events, functools.partial(choose_clip_id, selector=selection.Selector()))
+    audio_format = library_format()
+
+    typer.echo(f'Generating and playing commentary...')
+    player = playback.Player(audio_format, sink, started_at=started_at)
+    track = bytearray()
+    try:
+        for chunk in stream_commentary(placements, start, end, audio_format):
+            track += chunk
+            player.write(chunk)
+    finally:
+        player.close()
+    stats = player.join()
+
+    typer.echo(f'Time to first audio: {stats.time_to_first_audio or 0:.3f}s, '
+               f'underruns: {stats.underruns} ({stats.underrun_seconds:.3f}s starved)')
+    return pydub.AudioSegment(data=bytes(track), **audio_format._asdict())
+
+
+def main(match_id: int, start: int, end: int, audio_out: typing.Optional[str]=None, play: bool=False,
+         stream: bool=False, sink: str='device', cache_dir: typing.Optional[str]=None,
+         store: typing.Optional[str]=None, filter_stats: typing.Optional[str]=None, workers: int=1):
+    """
+    With --play --stream, playback starts while the commentary is still being rendered.
+    --sink is where streamed audio plays: 'device', 'null' or a WAV file path.
+    --store reads events from a columnar event store (see store.py) instead of StatsBomb open data.
+    --filter-stats reorders each clip's filters using a report from `analysis.py --profile-filters`.
+    --workers mixes the track on a process pool.
+    """
+    if filter_stats:
+        changed, skipped = filterstats.reorder_filters(*filterstats.load(filter_stats))
+        if skipped:
+            typer.echo(f'Filter stats don\'t match the current clips, leaving {len(skipped)} clips as they are '
+                       f'(re-run analysis.py --profile-filters): {", ".join(map(str, skipped))}', err=True)
+        typer.echo(f'Reordered filters for {changed} clips')
+
+    if play and stream:
+        audio = render_playing(match_id, start, end, playback.make_sink(sink), store)
+    else:
+        audio = render(match_id, start, end, cache_dir, store, workers)
 
     default_audio_out = f'{match_id}-{start}-{end}.wav'
     typer.echo(f'Writing audio file to {audio_out or default_audio_out}...')
     audio.export(audio_out or default_audio_out, format='wav')
 
-    if play:
+    if play and not stream:
         pydub.playback.play(audio)
 
     typer.echo('All done!')
@@ -0,0 +1,209 @@
+"""
+Pipelined rendering of many jobs
+
+Each render is split into stages (fetch -> match -> decode -> mix -> encode)
+running on their own threads, connected by bounded queues. While one job is
+being fetched another can be decoding and a third encoding, and a slow stage
+makes the stages before it wait (rather than piling up work in memory).
+
+    python pipeline.py 3788741:0:600 3788741:600:1200 ...
+
+Each stage reports how many jobs it handled, how long it was busy, and how long
+it stalled waiting for input or for room to pass its output on.
+"""
+import queue
+import threading
+import time
+import typing
+
+import pydub
+import typer
+
+import main
+
+
+class Job(typing.NamedTuple):
+    """ A render, filled in as it moves through the pipeline. """
+    match_id: int
+    start: int
+    end: int
+    audio_out: str
+    events: typing.Optional[list] = None
+    placements: typing.Optional[typing.List[main.Placement]] = None
+    audio_format: typing.Optional[main.AudioFormat] = None
+    writes: typing.Optional[typing.List[typing.Tuple[int, bytes]]] = None
+    audio: typing.Optional[pydub.AudioSegment] = None
+    error: typing.Optional[Exception] = None
+
+
+class StageStats(typing.NamedTuple):
+    name: str
+    items: int
+    busy: float
+    waiting_for_input: float
+    waiting_for_output: float
+
+
+# Stages
+
+
+def fetch(job: Job, store_path: typing.Optional[str]=None) -> Job:
+    return job._replace(events=main.fetch_events(job.match_id, job.start, job.end, store_path))
+
+
+def match(job: Job) -> Job:
+    placements = main.schedule_commentary(job.events, main.choose_clips(job.events))
+    return job._replace(events=None, placements=placements, audio_format=main.plan_format(placements))
+
+
+def decode(job: Job) -> Job:
+    return job._replace(placements=None, writes=list(main.clip_writes(job.placements, job.start, job.audio_format)))
+
+
+def mix(job: Job) -> Job:
+    length = (job.end - job.start)*job.audio_format.frame_rate*job.audio_format.frame_width
+    track = main.mix_writes(job.writes, length)
+    return job._replace(writes=None, audio=pydub.AudioSegment(data=bytes(track), **job.audio_format._asdict()))
+
+
+def encode(job: Job) -> Job:
+    job.audio.export(job.audio_out, format='wav')
+    return job._replace(audio=None)
+
+
+# Plumbing
+
+
+DONE = object()
+
+
+class Stage:
+    """
+    Runs `f` over the jobs from `inbox` on `workers` threads, passing results to
+    `outbox`. Jobs that have already failed are passed straight through.
+    """
+    def __init__(self, name: str, f: typing.Callable[[Job], Job], inbox: queue.Queue, outbox: queue.Queue, workers: int=1):
+        self.name = name
+        self.f = f
+        self.inbox = inbox
+        self.outbox = outbox
+        self._lock = threading.Lock()
+        self._running = workers
+        self._stats = {'items': 0, 'busy': 0.0, 'waiting_for_input': 0.0, 'waiting_for_output': 0.0}
+        self._threads = [threading.Thread(target=self._run, daemon=True) for _ in range(workers)]
+        for t in self._threads:
+            t.start()
+
+    def _run(self):
+        while True:
+            waiting_since = time.monotonic()
+            job = self.inbox.get()
+            started = time.monotonic()
+            if job is DONE:
+                # Let any other workers see it too; the last one out passes it on
+                self.inbox.put(DONE)
+                with self._lock:
+                    self._running -= 1
+                    if self._running == 0:
+                        self.outbox.put(DONE)
+                return
+
+            if job.error is None:
+                try:
+                    job = self.f(job)
+                except Exception as err:
+                    job = job._replace(error=err)
+            finished = time.monotonic()
+            self.outbox.put(job)
+
+            with self._lock:
+                self._stats['items'] += 1
+                self._stats['waiting_for_input'] += started - waiting_since
+                self._stats['busy'] += finished - started
+                self._stats['waiting_for_output'] += time.monotonic() - finished
+
+    def join(self):
+        for t in self._threads:
+            t.join()
+
+    def stats(self) -> StageStats:
+        with self._lock:
+            return StageStats(self.name, **self._stats)
+
+
+def run(jobs: typing.Iterable[Job], queue_size: int=2, decode_workers: int=2,
+        store_path: typing.Optional[str]=None) -> typing.Tuple[typing.List[Job], typing.List[StageStats]]:
+    """ Run jobs through the pipeline, returning the finished jobs (in completion order) and stage stats. """
+    stages_spec = [
+        ('fetch', lambda job: fetch(job, store_path), 1),
+        ('match', match, 1),
+        ('decode', decode, decode_workers),
+        ('mix', mix, 1),
+        ('encode', encode, 1),
+    ]
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(len(stages_spec) + 1)]
+    stages = [Stage(name, f, queues[i], queues[i + 1], workers) for i, (name, f, workers) in enumerate(stages_spec)]
+
+    feed_errors = []
+
+    def feed():
+        try:
+            for job in jobs:
+                queues[0].put(job)
+        except Exception as err:
+            feed_errors.append(err)
+        finally:
+            # However feeding ends, let the stages finish so `run` doesn't hang
+            queues[0].put(DONE)
+
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
+
+    finished = []
+    while True:
+        job = queues[-1].get()
+        if job is DONE:
+            break
+        finished.append(job)
+        typer.echo(f'Finished {job.audio_out}' + (f' (failed: {job.error})' if job.error else ''))
+
+    feeder.join()
+    for stage in stages:
+        stage.join()
+    if feed_errors:
+        raise feed_errors[0]
+    return finished, [stage.stats() for stage in stages]
+
+
+def report(stats: typing.List[StageStats], elapsed: float):
+    typer.echo(f'\n  {"stage":<8} {"jobs":>5} {"busy s":>8} {"jobs/s":>8} {"input stall s":>14} {"output stall s":>15}')
+    for s in stats:
+        throughput = s.items/s.busy if s.busy else 0.0
+        typer.echo(f'  {s.name:<8} {s.items:>5} {s.busy:>8.2f} {throughput:>8.2f} '
+                   f'{s.waiting_for_input:>14.2f} {s.waiting_for_output:>15.2f}')
+    typer.echo(f'\nTotal {elapsed:.2f}s')
+
+
+def parse_job(spec: str) -> Job:
+    try:
+        match_id, start, end = (int(x) for x in spec.split(':'))
+    except ValueError:
+        raise typer.BadParameter(f'{spec!r} is not MATCH_ID:START:END (all integers)')
+    if start >= end:
+        raise typer.BadParameter(f'{spec!r} ends before it starts')
+    return Job(match_id, start, end, f'{match_id}-{start}-{end}.wav')
+
+
+def cli(jobs: typing.List[str], queue_size: int=2, decode_workers: int=2, store: typing.Optional[str]=None):
+    """ JOBS are renders as MATCH_ID:START:END; each is written to MATCH_ID-START-END.wav. """
+    # Parse everything up front, so a bad spec fails before any rendering starts
+    parsed = [parse_job(j) for j in jobs]
+    started = time.monotonic()
+    finished, stats = run(parsed, queue_size, decode_workers, store)
+    report(stats, time.monotonic() - started)
+    if any(job.error for job in finished):
+        raise typer.Exit(1)
+
+
+if __name__ == "__main__":
+    typer.run(cli)
@@ -0,0 +1,231 @@
+"""
+Playing commentary while it is still being rendered
+
+Rendered audio is pushed into a ring buffer as it is produced, and a playback
+thread drains it into a sink (the sound device, or a null/file sink standing in
+for one). If rendering falls behind playback the sink is starved, which we
+count as an underrun.
+"""
+import threading
+import time
+import typing
+import wave
+
+
+# Anything with frame_rate, channels and sample_width, e.g. main.AudioFormat
+AudioFormat = typing.Any
+
+
+class PlaybackStats(typing.NamedTuple):
+    time_to_first_audio: typing.Optional[float]
+    underruns: int
+    underrun_seconds: float
+    seconds_played: float
+
+
+class RingBuffer:
+    """ A fixed-size byte buffer between one writer and one reader. Writes block while it is full. """
+    def __init__(self, capacity: int):
+        self._buffer = bytearray(capacity)
+        self._start = 0
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self.underruns = 0
+        self.underrun_seconds = 0.0
+
+    def write(self, data: bytes):
+        view = memoryview(data)
+        while view:
+            with self._cond:
+                self._cond.wait_for(lambda: self._size < len(self._buffer))
+                n = min(len(view), len(self._buffer) - self._size)
+                end = (self._start + self._size) % len(self._buffer)
+                first = min(n, len(self._buffer) - end)
+                self._buffer[end:end + first] = view[:first]
+                self._buffer[:n - first] = view[first:n]
+                self._size += n
+                self._cond.notify_all()
+            view = view[n:]
+
+    def close(self):
+        """ Mark the end of the stream; readers get what is left, then empty reads. """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def read(self, n: int, count_underruns: bool=True) -> bytes:
+        """ Read `n` bytes, waiting for them to be written (fewer only at the end of the stream). """
+        with self._cond:
+            if self._size < n and not self._closed:
+                stalled_at = time.monotonic()
+                self._cond.wait_for(lambda: self._size >= n or self._closed)
+                # Running into the end of the stream isn't running dry
+                if count_underruns and self._size >= n:
+                    self.underruns += 1
+                    self.underrun_seconds += time.monotonic() - stalled_at
+
+            n = min(n, self._size)
+            first = min(n, len(self._buffer) - self._start)
+            data = bytes(self._buffer[self._start:self._start + first]) + bytes(self._buffer[:n - first])
+            self._start = (self._start + n) % len(self._buffer)
+            self._size -= n
+            self._cond.notify_all()
+            return data
+
+
+# Sinks
+
+
+class Sink:
+    """ Somewhere to send audio as it plays. """
+    def open(self, audio_format: AudioFormat):
+        pass
+
+    def write(self, data: bytes):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class DeviceSink(Sink):
+    """ The default sound device (requires pyaudio). """
+    def open(self, audio_format: AudioFormat):
+        try:
+            import pyaudio
+        except ImportError as err:
+            raise RuntimeError('Streaming playback needs pyaudio installed (or use a null/file sink)') from err
+        self._pyaudio = pyaudio.PyAudio()
+        self._stream = self._pyaudio.open(format=self._pyaudio.get_format_from_width(audio_format.sample_width),
+                                          channels=audio_format.channels,
+                                          rate=audio_format.frame_rate,
+                                          output=True)
+
+    def write(self, data: bytes):
+        self._stream.write(data)
+
+    def close(self):
+        self._stream.stop_stream()
+        self._stream.close()
+        self._pyaudio.terminate()
+
+
+class NullSink(Sink):
+    """
+    Discards audio. With `real_time`, writes take as long as playing the audio
+    would, so it paces playback like a sound device.
+    """
+    def __init__(self, real_time: bool=True):
+        self.real_time = real_time
+
+    def open(self, audio_format: AudioFormat):
+        self._bytes_per_second = audio_format.frame_rate*audio_format.channels*audio_format.sample_width
+        self._played = 0
+        self._started_at = None
+
+    def write(self, data: bytes):
+        if self._started_at is None:
+            self._started_at = time.monotonic()
+        self._played += len(data)
+        if self.real_time:
+            # Sleep until the device would have finished this data, without drifting
+            time.sleep(max(0.0, self._started_at + self._played/self._bytes_per_second - time.monotonic()))
+
+
+class FileSink(NullSink):
+    """ Writes the played audio to a WAV file. """
+    def __init__(self, path: str, real_time: bool=True):
+        super().__init__(real_time)
+        self.path = path
+
+    def open(self, audio_format: AudioFormat):
+        super().open(audio_format)
+        self._wav = wave.open(self.path, 'wb')
+        self._wav.setnchannels(audio_format.channels)
+        self._wav.setsampwidth(audio_format.sample_width)
+        self._wav.setframerate(audio_format.frame_rate)
+
+    def write(self, data: bytes):
+        self._wav.writeframes(data)
+        super().write(data)
+
+    def close(self):
+        self._wav.close()
+
+
+def make_sink(name: str) -> Sink:
+    """ 'device', 'null', or the path of a WAV file to play into. """
+    if name == 'device':
+        return DeviceSink()
+    if name == 'null':
+        return NullSink()
+    return FileSink(name)
+
+
+# Playback
+
+
+class Player:
+    """
+    Plays audio from a ring buffer on a background thread. Feed it with `write`
+    from the renderer, then `close` and `join` once rendering is done.
+
+    Time to first audio is measured from `started_at` (a `time.monotonic()`
+    timestamp, e.g. when rendering began), defaulting to when the player is created.
+    """
+    def __init__(self, audio_format: AudioFormat, sink: Sink, buffer_seconds: float=5.0, block_seconds: float=0.1,
+                 started_at: typing.Optional[float]=None):
+        frame_width = audio_format.channels*audio_format.sample_width
+        self.audio_format = audio_format
+        self.sink = sink
+        self.block_size = max(1, int(audio_format.frame_rate*block_seconds))*frame_width
+        self.buffer = RingBuffer(max(1, int(audio_format.frame_rate*buffer_seconds))*frame_width)
+        self._started_at = started_at or time.monotonic()
+        self._first_audio_at = None
+        self._played = 0
+        self._error = None
+        self._thread = threading.Thread(target=self._play, daemon=True)
+        self._thread.start()
+
+    def _play(self):
+        try:
+            self.sink.open(self.audio_format)
+            try:
+                while True:
+                    # Waiting for the very first block isn't an underrun; nothing is playing yet
+                    block = self.buffer.read(self.block_size, count_underruns=self._first_audio_at is not None)
+                    if not block:
+                        break
+                    if self._first_audio_at is None:
+                        self._first_audio_at = time.monotonic()
+                    self.sink.write(block)
+                    self._played += len(block)
+            finally:
+                self.sink.close()
+        except Exception as err:
+            self._error = err
+            # Don't leave the renderer blocked on a full buffer
+            while self.buffer.read(self.block_size, count_underruns=False):
+                pass
+
+    def write(self, data: bytes):
+        # Fail fast (e.g. no sound device) rather than rendering everything first
+        if self._error:
+            raise self._error
+        self.buffer.write(data)
+
+    def close(self):
+        self.buffer.close()
+
+    def join(self) -> PlaybackStats:
+        self._thread.join()
+        if self._error:
+            raise self._error
+        bytes_per_second = self.audio_format.frame_rate*self.audio_format.channels*self.audio_format.sample_width
+        return PlaybackStats(
+            time_to_first_audio=self._first_audio_at and self._first_audio_at - self._started_at,
+            underruns=self.buffer.underruns,
+            underrun_seconds=self.buffer.underrun_seconds,
+            seconds_played=self._played/bytes_per_second,
+        )
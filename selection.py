@@ -0,0 +1,100 @@
+"""
+Weighted clip selection with a penalty on recently played clips
+
+Each clip has a weight (`CommentaryClip.weight`). Picking among a set of
+candidates uses an alias table (Vose's method) built for those weights, so a
+draw costs the same however many candidates there are. Tables are cached by
+the candidates' weights, and the same few candidate sets come up again and again.
+
+Clips played within the last `history` choices are penalised by how recently
+they were played: the clip just played is most likely to be rejected, and the
+penalty fades to nothing over the window. Rejected draws are retried a bounded
+number of times, after which the least penalised draw is used. So picking a clip
+never scans the candidates or the history.
+"""
+import collections
+import functools
+import random
+import typing
+
+import commentary
+
+
+class AliasTable(typing.NamedTuple):
+    probabilities: typing.Tuple[float, ...]
+    aliases: typing.Tuple[int, ...]
+
+
+@functools.lru_cache(maxsize=4096)
+def alias_table(weights: typing.Tuple[float, ...]) -> AliasTable:
+    """ Build an alias table for sampling indices in proportion to `weights` (Vose's method). """
+    n = len(weights)
+    total = sum(weights)
+    if n == 0 or total <= 0:
+        raise ValueError(f'Cannot sample from weights {weights}')
+    scaled = [w*n/total for w in weights]
+    probabilities = [1.0]*n
+    aliases = list(range(n))
+    small = [i for i, p in enumerate(scaled) if p < 1]
+    large = [i for i, p in enumerate(scaled) if p >= 1]
+    while small and large:
+        s, l = small.pop(), large.pop()
+        probabilities[s] = scaled[s]
+        aliases[s] = l
+        scaled[l] -= 1 - scaled[s]
+        (small if scaled[l] < 1 else large).append(l)
+    # Anything left over is 1, give or take rounding
+    return AliasTable(tuple(probabilities), tuple(aliases))
+
+
+def sample(table: AliasTable, rng=random) -> int:
+    i = int(rng.random()*len(table.probabilities))
+    return i if rng.random() < table.probabilities[i] else table.aliases[i]
+
+
+class Selector:
+    """
+    Chooses among candidate clips by weight, avoiding repeats. A clip played `k`
+    choices ago (within the last `history`) is rejected with probability
+    `penalty*(history - k + 1)/history`, with up to `retries` redraws.
+    """
+    def __init__(self, history: int=20, penalty: float=1.0, retries: int=4, rng=random):
+        self.history = history
+        self.penalty = penalty
+        self.retries = retries
+        self.rng = rng
+        self._plays = 0
+        self._window = collections.deque()  # (play number, clip id), oldest first
+        self._last_played: typing.Dict[int, int] = {}
+
+    def played(self, clip_id: int):
+        """ Record a clip as played. """
+        self._plays += 1
+        self._window.append((self._plays, clip_id))
+        self._last_played[clip_id] = self._plays
+        while self._window and self._window[0][0] <= self._plays - self.history:
+            play, forgotten = self._window.popleft()
+            if self._last_played.get(forgotten) == play:
+                del self._last_played[forgotten]
+
+    def recency_penalty(self, clip_id: int) -> float:
+        last = self._last_played.get(clip_id)
+        if last is None:
+            return 0.0
+        return self.penalty*(self.history - (self._plays - last))/self.history
+
+    def choose(self, candidates: typing.Sequence[commentary.CommentaryClip]) -> commentary.CommentaryClip:
+        """ Pick one of `candidates`, which must include a clip with a positive weight. """
+        table = alias_table(tuple(c.weight for c in candidates))
+
+        best, best_penalty = None, float('inf')
+        for _ in range(1 + self.retries):
+            clip = candidates[sample(table, self.rng)]
+            penalty = self.recency_penalty(clip.clip_id)
+            if penalty < best_penalty:
+                best, best_penalty = clip, penalty
+            if self.rng.random() >= penalty:
+                best = clip
+                break
+        self.played(best.clip_id)
+        return best
@@ -0,0 +1,249 @@
+"""
+Long-running render service
+
+Serves renders over HTTP (TCP or a Unix socket), keeping decoded clips, the clip
+index and fetched match events warm between requests.
+
+    GET /render?match_id=<id>&start=<s>&end=<s>  -> audio/wav
+    GET /metrics                                 -> JSON queue/cache metrics
+
+Renders are streamed: the WAV header goes out as soon as the plan is made, and
+then the audio as each clip is mixed. Concurrent requests for the same
+(match_id, start, end) share a single render, each reading it from the start.
+Once `max_concurrent` renders are running and `max_queue` more are waiting,
+further renders are rejected with a 503 rather than piling up.
+"""
+import concurrent.futures
+import http.server
+import json
+import os
+import socketserver
+import struct
+import threading
+import typing
+import urllib.parse
+
+import typer
+
+import main
+
+
+CHUNK_SIZE = 64*1024
+
+RenderKey = typing.Tuple[int, int, int]
+
+
+class Overloaded(Exception):
+    """ Raised when the render queue is full. """
+
+
+def wav_header(audio_format: main.AudioFormat, data_length: int) -> bytes:
+    """ The header of a PCM WAV file holding `data_length` bytes of audio. """
+    frame_rate, channels, sample_width = audio_format
+    return struct.pack('<4sI4s4sIHHIIHH4sI', b'RIFF', 36 + data_length, b'WAVE', b'fmt ', 16, 1,
+                       channels, frame_rate, frame_rate*channels*sample_width, channels*sample_width,
+                       8*sample_width, b'data', data_length)
+
+
+class RenderStream:
+    """
+    The bytes of a WAV file as a render produces them. Any number of readers can
+    iterate over it, each from the start, waiting for more as they catch up.
+    """
+    def __init__(self):
+        self.length: typing.Optional[int] = None  # Set before the first chunk is written
+        self._chunks: typing.List[bytes] = []
+        self._done = False
+        self._error: typing.Optional[Exception] = None
+        self._condition = threading.Condition()
+
+    def write(self, chunk: bytes):
+        with self._condition:
+            self._chunks.append(chunk)
+            self._condition.notify_all()
+
+    def close(self, error: typing.Optional[Exception]=None):
+        with self._condition:
+            self._done = True
+            self._error = error
+            self._condition.notify_all()
+
+    def __iter__(self) -> typing.Iterator[bytes]:
+        i = 0
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: i < len(self._chunks) or self._done)
+                if i < len(self._chunks):
+                    chunk = self._chunks[i]
+                elif self._error:
+                    raise self._error
+                else:
+                    return
+            i += 1
+            yield chunk
+
+
+class RenderService:
+    def __init__(self, max_concurrent: int=2, max_queue: int=8):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrent)
+        self._lock = threading.Lock()
+        self._pending: typing.Dict[RenderKey, RenderStream] = {}
+        self._counts = {'queued': 0, 'running': 0, 'completed': 0, 'failed': 0, 'coalesced': 0, 'rejected': 0}
+
+    def submit(self, key: RenderKey) -> RenderStream:
+        """ Start rendering `key`, or join the render already in progress for it. """
+        with self._lock:
+            if key in self._pending:
+                self._counts['coalesced'] += 1
+                return self._pending[key]
+            if self._counts['queued'] + self._counts['running'] >= self.max_concurrent + self.max_queue:
+                self._counts['rejected'] += 1
+                raise Overloaded(f'{self._counts["queued"]} renders already queued')
+            self._counts['queued'] += 1
+            stream = RenderStream()
+            future = self._executor.submit(self._render, key, stream)
+            self._pending[key] = stream
+        future.add_done_callback(lambda f: self._finished(key, f))
+        return stream
+
+    def _render(self, key: RenderKey, stream: RenderStream):
+        with self._lock:
+            self._counts['queued'] -= 1
+            self._counts['running'] += 1
+        try:
+            match_id, start, end = key
+            match_events = main.fetch_events(match_id, start, end)
+            placements = main.schedule_commentary(match_events, main.choose_clips(match_events))
+            audio_format = main.plan_format(placements)
+
+            # The length is known from the plan, so the header can go out before any mixing
+            length = main.track_length(placements, start, end, audio_format)
+            header = wav_header(audio_format, length)
+            stream.length = len(header) + length
+            stream.write(header)
+            for chunk in main.stream_commentary(placements, start, end, audio_format):
+                stream.write(chunk)
+        except Exception as err:
+            stream.close(err)
+            raise
+        else:
+            stream.close()
+        finally:
+            with self._lock:
+                self._counts['running'] -= 1
+
+    def _finished(self, key: RenderKey, future: concurrent.futures.Future):
+        with self._lock:
+            self._pending.pop(key, None)
+            self._counts['failed' if future.exception() else 'completed'] += 1
+
+    def metrics(self) -> dict:
+        with self._lock:
+            counts = dict(self._counts)
+        return {
+            **counts,
+            'queue_depth': counts['queued'],
+            'max_concurrent': self.max_concurrent,
+            'max_queue': self.max_queue,
+            'clip_cache': main.load_clip.cache_info()._asdict(),
+            'event_cache': main.fetch_raw_events.cache_info()._asdict(),
+        }
+
+
+class RenderHandler(http.server.BaseHTTPRequestHandler):
+    service: RenderService  # Set on the server-specific subclass
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        if url.path == '/metrics':
+            self.send_body(200, json.dumps(self.service.metrics()).encode(), 'application/json')
+        elif url.path == '/render':
+            self.render(urllib.parse.parse_qs(url.query))
+        else:
+            self.send_error(404)
+
+    def render(self, query: dict):
+        try:
+            key = tuple(int(query[k][0]) for k in ('match_id', 'start', 'end'))
+        except (KeyError, ValueError):
+            self.send_error(400, 'Expected integer match_id, start and end parameters')
+            return
+
+        try:
+            stream = self.service.submit(key)
+            chunks = iter(stream)
+            # Wait for the plan, so that a failure to make one can still be reported
+            header = next(chunks)
+        except Overloaded as err:
+            self.send_response(503)
+            self.send_header('Retry-After', '1')
+            self.end_headers()
+            self.wfile.write(str(err).encode())
+            return
+        except Exception as err:
+            self.send_error(500, f'Render failed: {err}')
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'audio/wav')
+        self.send_header('Content-Length', str(stream.length))
+        self.end_headers()
+        try:
+            self.write_body(header)
+            for chunk in chunks:
+                self.write_body(chunk)
+        except Exception as err:
+            # Too late for an error response; cut the body short so the client sees it's incomplete
+            self.log_error('Render failed mid-stream: %s', err)
+            self.close_connection = True
+
+    def send_body(self, status: int, body: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.write_body(body)
+
+    def write_body(self, body: bytes):
+        view = memoryview(body)
+        for i in range(0, len(body), CHUNK_SIZE):
+            self.wfile.write(view[i:i+CHUNK_SIZE])
+
+    def address_string(self):
+        # Unix socket peers have no address
+        return self.client_address[0] if self.client_address else 'unix'
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+        super().server_bind()
+
+
+def serve(host: str='127.0.0.1', port: int=8000, unix_socket: typing.Optional[str]=None,
+          max_concurrent: int=2, max_queue: int=8):
+    service = RenderService(max_concurrent, max_queue)
+    handler = type('Handler', (RenderHandler,), {'service': service})
+
+    if unix_socket:
+        server = UnixHTTPServer(unix_socket, handler)
+        typer.echo(f'Serving renders on {unix_socket}...')
+    else:
+        server = http.server.ThreadingHTTPServer((host, port), handler)
+        typer.echo(f'Serving renders on http://{host}:{port}...')
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    typer.run(serve)
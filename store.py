@@ -0,0 +1,394 @@
+"""
+Provider-neutral columnar event store
+
+Events from any provider are normalised into one Arrow schema (`SCHEMA`) and
+saved as Arrow IPC (.arrow, memory-mapped, so opening and slicing a store reads
+nothing in) or Parquet (.parquet). `RowView` exposes a row with the same
+attribute paths as `statsbombapi.Event`, so the filters in `commentary` run on a
+store unchanged. The columns a filter reads are converted to Python lists on
+first use (per table), since indexing Arrow arrays one value at a time is far
+slower; columns no filter touches are never converted.
+
+Requires pyarrow.
+
+    python store.py statsbomb <open-data checkout or events file> <out.arrow>
+    python store.py table <export.csv|.parquet> <out.arrow> --mapping mapping.json
+
+A mapping file for other providers' exports names the export's column for each
+schema column, and optionally translates values (e.g. into StatsBomb's event
+type names, which the filters use):
+
+    {"columns": {"match_id": "game_id", "type": "action", "x": "start_x", ...},
+     "values": {"type": {"pass": "Pass", "shot": "Shot", ...}}}
+"""
+import functools
+import json
+import os
+import typing
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv
+import pyarrow.parquet
+import typer
+
+import events
+
+
+def _category():
+    return pa.dictionary(pa.int16(), pa.string())
+
+
+SCHEMA = pa.schema([
+    ('match_id', pa.int64()),
+    ('event_id', pa.string()),
+    ('index', pa.int32()),
+    ('period', pa.int8()),
+    ('minute', pa.int16()),
+    ('second', pa.int16()),
+    ('duration', pa.float64()),
+    ('type', _category()),
+    ('position', _category()),
+    ('x', pa.float64()),
+    ('y', pa.float64()),
+    ('end_x', pa.float64()),
+    ('end_y', pa.float64()),
+    ('pass_height', _category()),
+    ('pass_outcome', _category()),
+    ('pass_technique', _category()),
+    ('pass_length', pa.float64()),
+    ('pass_cross', pa.bool_()),
+    ('shot_outcome', _category()),
+    ('shot_type', _category()),
+    ('shot_technique', _category()),
+    ('shot_body_part', _category()),
+    ('shot_xg', pa.float64()),
+    ('shot_xg2', pa.float64()),
+    ('shot_one_on_one', pa.bool_()),
+    ('dribble_outcome', _category()),
+    ('counterpress', pa.bool_()),
+    ('foul_card', _category()),
+])
+
+
+# Attribute paths of `statsbombapi.Event` -> schema columns. A string is a column,
+# a pair of strings an [x, y] location, and a dict a nested section (which is None
+# when all of its columns are null).
+FIELDS = {
+    'id': 'event_id',
+    'index': 'index',
+    'period': 'period',
+    'minute': 'minute',
+    'second': 'second',
+    'duration': 'duration',
+    'type': {'name': 'type'},
+    'position': {'name': 'position'},
+    'location': ('x', 'y'),
+    'pass_': {
+        'end_location': ('end_x', 'end_y'),
+        'height': {'name': 'pass_height'},
+        'outcome': {'name': 'pass_outcome'},
+        'technique': {'name': 'pass_technique'},
+        'length': 'pass_length',
+        'cross': 'pass_cross',
+    },
+    'carry': {'end_location': ('end_x', 'end_y')},
+    'shot': {
+        'outcome': {'name': 'shot_outcome'},
+        'type': {'name': 'shot_type'},
+        'technique': {'name': 'shot_technique'},
+        'body_part': {'name': 'shot_body_part'},
+        'statsbomb_xg': 'shot_xg',
+        'statsbomb_xg2': 'shot_xg2',
+        'one_on_one': 'shot_one_on_one',
+    },
+    'dribble': {'outcome': {'name': 'dribble_outcome'}},
+    'dribbled_past': {'counterpress': 'counterpress'},
+    'foul_committed': {'card': {'name': 'foul_card'}},
+}
+
+# Sections that only exist on one event type (end locations are shared)
+SECTION_TYPES = {
+    'pass_': 'Pass',
+    'carry': 'Carry',
+    'shot': 'Shot',
+    'dribble': 'Dribble',
+    'dribbled_past': 'Dribbled Past',
+    'foul_committed': 'Foul Committed',
+}
+
+
+# Reading
+
+
+class Columns(dict):
+    """ Python values for the columns of a table, each converted (copied) into a list on first use. """
+    def __init__(self, table: pa.Table):
+        super().__init__()
+        self.table = table
+
+    def __missing__(self, name: str) -> list:
+        column = self.table.column(name).combine_chunks()
+        if pa.types.is_dictionary(column.type):
+            # Share one string object per category rather than one per row
+            names = column.dictionary.to_pylist()
+            values = [None if i is None else names[i] for i in column.indices.to_pylist()]
+        else:
+            values = column.to_pylist()
+        self[name] = values
+        return values
+
+
+class SectionSpec(typing.NamedTuple):
+    fields: dict
+    leaves: typing.Tuple[str, ...]
+    event_type: typing.Optional[str]
+    name_only: bool  # Just {'name': column}, e.g. event type or pass height
+
+
+class Named(typing.NamedTuple):
+    """ A section with just a name, shared between all rows with that name. """
+    name: str
+
+
+@functools.lru_cache(maxsize=None)
+def named(name: str) -> Named:
+    return Named(name)
+
+
+def compile_fields(fields: dict, event_types: typing.Dict[str, str]={}) -> dict:
+    """ Replace the nested sections in `fields` with `SectionSpec`s, so lookups don't have to walk them. """
+    compiled = {}
+    for name, field in fields.items():
+        if isinstance(field, dict):
+            inner = compile_fields(field)
+            leaves = []
+            for f in inner.values():
+                leaves += f.leaves if isinstance(f, SectionSpec) else f if isinstance(f, tuple) else [f]
+            field = SectionSpec(inner, tuple(leaves), event_types.get(name), list(inner) == ['name'])
+        compiled[name] = field
+    return compiled
+
+
+COMPILED_FIELDS = compile_fields(FIELDS, SECTION_TYPES)
+
+
+class RowSection:
+    """ Part of a row, looked up through `FIELDS`. Unknown attributes are `None`. """
+    __slots__ = ('_columns', '_row', '_fields')
+
+    def __init__(self, columns: Columns, row: int, fields: dict):
+        self._columns = columns
+        self._row = row
+        self._fields = fields
+
+    def __getattr__(self, name):
+        field = self._fields.get(name)
+        if field is None:
+            return None
+        columns, row = self._columns, self._row
+        if type(field) is str:
+            return columns[field][row]
+        if type(field) is tuple:
+            x, y = (columns[f][row] for f in field)
+            return None if x is None else [x, y]
+        if field.event_type and columns['type'][row] != field.event_type:
+            return None
+        if field.name_only:
+            value = columns[field.leaves[0]][row]
+            return None if value is None else named(value)
+        if all(columns[f][row] is None for f in field.leaves):
+            return None
+        return RowSection(columns, row, field.fields)
+
+
+class RowView(RowSection):
+    """ A single event in a store. Stands in for `statsbombapi.Event`. """
+    __slots__ = ()
+
+    def __init__(self, columns: Columns, row: int):
+        super().__init__(columns, row, COMPILED_FIELDS)
+
+
+def save(table: pa.Table, path: str):
+    # IPC files need a single dictionary per column
+    table = table.unify_dictionaries()
+    if path.endswith('.parquet'):
+        pyarrow.parquet.write_table(table, path)
+    else:
+        with pa.OSFile(path, 'wb') as f, pa.ipc.new_file(f, table.schema) as writer:
+            writer.write_table(table)
+
+
+def load(path: str) -> pa.Table:
+    """ Open a store. Arrow IPC files are memory-mapped, so this doesn't read the events in. """
+    if path.endswith('.parquet'):
+        return pyarrow.parquet.read_table(path, memory_map=True)
+    return pa.ipc.open_file(pa.memory_map(path)).read_all()
+
+
+@functools.lru_cache(maxsize=4)
+def _load_version(path: str, mtime_ns: int) -> pa.Table:
+    return load(path)
+
+
+def load_cached(path: str) -> pa.Table:
+    """
+    `load`, keeping the table for later calls in this process (until the file
+    changes). Parquet stores are decoded in full on every `load`, so anything
+    opening a store repeatedly (per match, or per render) should use this.
+    """
+    return _load_version(os.path.abspath(path), os.stat(path).st_mtime_ns)
+
+
+def match_slices(table: pa.Table) -> typing.Dict[int, typing.Tuple[int, int]]:
+    """ The (offset, length) of each match's rows. Stores keep each match's events together. """
+    match_ids = table.column('match_id').combine_chunks()
+    if len(match_ids) == 0:
+        return {}
+    changes = pc.not_equal(match_ids.slice(1), match_ids.slice(0, len(match_ids) - 1))
+    starts = [0] + [i + 1 for i in pc.indices_nonzero(changes).to_pylist()]
+    ends = starts[1:] + [len(match_ids)]
+    return {match_ids[s].as_py(): (s, e - s) for s, e in zip(starts, ends)}
+
+
+def select(table: pa.Table, match_id: typing.Optional[int]=None,
+           start: typing.Optional[int]=None, end: typing.Optional[int]=None) -> pa.Table:
+    """ The events of a match (or of every match) between `start` and `end`, in seconds. """
+    start_time = pc.add(pc.multiply(pc.cast(table.column('minute'), pa.int32()), 60), table.column('second'))
+    end_time = pc.add(pc.cast(start_time, pa.float64()), pc.fill_null(table.column('duration'), 0))
+
+    conditions = []
+    if match_id is not None:
+        conditions.append(pc.equal(table.column('match_id'), match_id))
+    if start is not None:
+        conditions.append(pc.greater_equal(start_time, start))
+    if end is not None:
+        conditions.append(pc.less_equal(end_time, end))
+    if not conditions:
+        return table
+    return table.filter(functools.reduce(pc.and_, conditions))
+
+
+def rows(table: pa.Table) -> typing.List[RowView]:
+    """ Views of every row of a table, sharing one set of columns. """
+    columns = Columns(table)
+    return [RowView(columns, i) for i in range(len(table))]
+
+
+def fetch_events(path: str, match_id: int, start: int, end: int) -> typing.List[RowView]:
+    return rows(select(load_cached(path), match_id, start, end))
+
+
+# Adapters
+
+
+def _get(data: dict, *path):
+    for key in path:
+        if not isinstance(data, dict):
+            return None
+        data = data.get(key)
+    return data
+
+
+def statsbomb_row(match_id: int, data: dict) -> dict:
+    location = data.get('location') or [None, None]
+    end_location = _get(data, 'pass', 'end_location') or _get(data, 'carry', 'end_location') or [None, None]
+    return {
+        'match_id': match_id,
+        'event_id': data.get('id'),
+        'index': data.get('index'),
+        'period': data.get('period'),
+        'minute': data.get('minute'),
+        'second': data.get('second'),
+        'duration': data.get('duration'),
+        'type': _get(data, 'type', 'name'),
+        'position': _get(data, 'position', 'name'),
+        'x': location[0],
+        'y': location[1],
+        'end_x': end_location[0],
+        'end_y': end_location[1],
+        'pass_height': _get(data, 'pass', 'height', 'name'),
+        'pass_outcome': _get(data, 'pass', 'outcome', 'name'),
+        'pass_technique': _get(data, 'pass', 'technique', 'name'),
+        'pass_length': _get(data, 'pass', 'length'),
+        'pass_cross': _get(data, 'pass', 'cross'),
+        'shot_outcome': _get(data, 'shot', 'outcome', 'name'),
+        'shot_type': _get(data, 'shot', 'type', 'name'),
+        'shot_technique': _get(data, 'shot', 'technique', 'name'),
+        'shot_body_part': _get(data, 'shot', 'body_part', 'name'),
+        'shot_xg': _get(data, 'shot', 'statsbomb_xg'),
+        'shot_xg2': _get(data, 'shot', 'statsbomb_xg2'),
+        'shot_one_on_one': _get(data, 'shot', 'one_on_one'),
+        'dribble_outcome': _get(data, 'dribble', 'outcome', 'name'),
+        'counterpress': _get(data, 'dribbled_past', 'counterpress'),
+        'foul_card': _get(data, 'foul_committed', 'card', 'name'),
+    }
+
+
+def from_statsbomb(paths: typing.List[str]) -> pa.Table:
+    """ Convert StatsBomb open-data event files into a store table. """
+    batches = []
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            records = [statsbomb_row(events.match_id(path), data) for data in events.iter_json_array(f)]
+        batches.append(pa.RecordBatch.from_pylist(records, schema=SCHEMA))
+    return pa.Table.from_batches(batches, schema=SCHEMA)
+
+
+def from_table(table: pa.Table, columns: typing.Dict[str, str],
+               values: typing.Optional[typing.Dict[str, typing.Dict[str, str]]]=None) -> pa.Table:
+    """
+    Convert another provider's tabular export into a store table. `columns` maps
+    schema columns to the export's columns, and `values` translates the values of
+    (string) schema columns. Schema columns without an export column are null.
+    """
+    values = values or {}
+    arrays = []
+    for field in SCHEMA:
+        if field.name not in columns:
+            arrays.append(pa.nulls(len(table), field.type))
+            continue
+        column = table.column(columns[field.name])
+        if field.name in values:
+            mapping = values[field.name]
+            column = pa.array([mapping.get(v, v) for v in column.to_pylist()], pa.string())
+        if pa.types.is_dictionary(field.type):
+            column = pc.cast(column, pa.string()).dictionary_encode()
+            column = pc.cast(column, field.type) if column.type != field.type else column
+        else:
+            column = pc.cast(column, field.type)
+        arrays.append(column)
+    return pa.Table.from_arrays(arrays, schema=SCHEMA).sort_by([('match_id', 'ascending'), ('index', 'ascending')])
+
+
+def read_table(path: str) -> pa.Table:
+    if path.endswith('.parquet'):
+        return pyarrow.parquet.read_table(path)
+    return pyarrow.csv.read_csv(path)
+
+
+# Command line
+
+
+app = typer.Typer()
+
+
+@app.command()
+def statsbomb(data_path: str, out: str):
+    """ Convert StatsBomb open-data event files into a store. """
+    paths = events.event_files(data_path)
+    typer.echo(f'Converting {len(paths)} matches...')
+    save(from_statsbomb(paths), out)
+
+
+@app.command()
+def table(export_path: str, out: str, mapping: str=typer.Option(...)):
+    """ Convert a CSV or Parquet export into a store, using a JSON column/value mapping. """
+    with open(mapping) as f:
+        spec = json.load(f)
+    save(from_table(read_table(export_path), spec['columns'], spec.get('values')), out)
+
+
+if __name__ == "__main__":
+    app()